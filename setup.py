@@ -13,4 +13,7 @@ setup(
         "tqdm",
         "python-dateutil"
         ],
+    entry_points={
+        'console_scripts': ['dalle-sessions-ingest=dalle_sessions.ingest:main'],
+    },
 )
@@ -0,0 +1,123 @@
+import io
+import base64
+import PIL.Image
+import PIL.ImageDraw
+import numpy as np
+
+
+def doc_to_array(doc):
+    """
+    Returns the image of a document as an HxWx3 uint8 array without modifying the document
+    """
+    if doc.tensor is not None:
+        return _to_rgb(np.asarray(doc.tensor))
+
+    uri = doc.uri
+    if uri:
+        if uri.startswith('data:'):
+            # dalle-flow returns the images inline as data uris -- decode them directly
+            return _decode_image(base64.b64decode(uri.split(',', 1)[1]))
+        from docarray import Document
+        return _to_rgb(Document(uri=uri).load_uri_to_image_tensor().tensor)
+
+    if doc.blob:
+        return _decode_image(doc.blob)
+
+    raise ValueError("the document has no tensor, uri or blob -- there is no image to render")
+
+
+def _decode_image(data):
+    img = PIL.Image.open(io.BytesIO(data))
+    return _to_rgb(np.asarray(img.convert('RGB')))
+
+
+def _to_rgb(arr):
+    if arr.dtype != np.uint8:
+        # Float image tensors are usually normalized to [0, 1]
+        if np.issubdtype(arr.dtype, np.floating) and arr.size > 0 and arr.max() <= 1.0:
+            arr = arr * 255
+        arr = np.clip(arr, 0, 255).astype(np.uint8)
+    if arr.ndim == 2:
+        arr = np.stack([arr] * 3, axis=-1)
+    elif arr.shape[2] == 1:
+        arr = np.repeat(arr, 3, axis=2)
+    elif arr.shape[2] == 4:
+        arr = arr[:, :, :3]
+    return arr
+
+
+def _resize(arr, size):
+    if arr.shape[1] == size[0] and arr.shape[0] == size[1]:
+        return arr
+    return np.asarray(PIL.Image.fromarray(arr).resize(size, PIL.Image.BILINEAR))
+
+
+def compose_grid(images, ncols=None, padding=2, scale=1.0, background=255, show_index=False):
+    """
+    Builds a single image with the given images laid out on a grid
+
+    Parameters:
+        images:list -- HxWxC arrays, tiles of different sizes are resized to the size of the first one
+        ncols:int -- number of columns, defaults to a square-ish grid
+        padding:int -- pixels between tiles
+        scale:float -- downscale factor applied to every tile (e.g. 0.5 for half size)
+        background:int -- value used for the padding
+        show_index:bool -- draw the index of each tile in its top left corner
+    """
+    if len(images) == 0:
+        raise ValueError("no images to compose")
+    if ncols is None:
+        ncols = int(np.ceil(np.sqrt(len(images))))
+    nrows = int(np.ceil(len(images) / ncols))
+
+    th = max(1, int(round(images[0].shape[0] * scale)))
+    tw = max(1, int(round(images[0].shape[1] * scale)))
+
+    grid = np.full((nrows * th + (nrows + 1) * padding, ncols * tw + (ncols + 1) * padding, 3), background, dtype=np.uint8)
+    for i, img in enumerate(images):
+        r, c = divmod(i, ncols)
+        y = padding + r * (th + padding)
+        x = padding + c * (tw + padding)
+        grid[y:y + th, x:x + tw] = _resize(_to_rgb(img), (tw, th))
+
+    if show_index:
+        pimg = PIL.Image.fromarray(grid)
+        draw = PIL.ImageDraw.Draw(pimg)
+        for i in range(len(images)):
+            r, c = divmod(i, ncols)
+            xy = (padding + c * (tw + padding) + 4, padding + r * (th + padding) + 4)
+            draw.rectangle([xy, (xy[0] + 8 * len(str(i)) + 4, xy[1] + 14)], fill=(0, 0, 0))
+            draw.text((xy[0] + 2, xy[1] + 2), str(i), fill=(255, 255, 255))
+        grid = np.asarray(pimg)
+
+    return grid
+
+
+def compose_strip(images, padding=2, scale=1.0, background=255):
+    """
+    Builds a single image with the given images side by side
+    """
+    return compose_grid(images, ncols=len(images), padding=padding, scale=scale, background=background)
+
+
+def compose_docs(docs, ncols=None, padding=2, scale=1.0, show_index=False):
+    """
+    Builds a grid image from the images of a list of documents (e.g. the matches of a query)
+    """
+    return compose_grid([doc_to_array(d) for d in docs], ncols=ncols, padding=padding, scale=scale, show_index=show_index)
+
+
+def save_array(arr, outfile):
+    PIL.Image.fromarray(arr).save(outfile)
+
+
+def show_array(arr):
+    """
+    Displays the image inline when running in a notebook, otherwise opens it in the system viewer
+    """
+    img = PIL.Image.fromarray(arr)
+    try:
+        from IPython.display import display
+        display(img)
+    except ImportError:
+        img.show()
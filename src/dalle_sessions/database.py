@@ -1,4 +1,4 @@
-from docarray import Document
+from docarray import Document, DocumentArray
 from docarray.array.match import MatchArray
 import sqlite3
 import os
@@ -10,44 +10,51 @@ import re
 import matplotlib.pyplot as plt
 import numpy as np
 from .utils import hash_data
+from .datastore import open_datastore, PackFileStore
 
 class QueryDatabase:
-    def __init__(self, dbfile="queries.db", datastore="db_datastore"):
+    def __init__(self, dbfile="queries.db", datastore="db_datastore", backend="loose"):
+        """
+        Parameters:
+            dbfile:str -- path to the sqlite database file
+            datastore:str -- path to the folder holding the document and session data
+            backend:str -- datastore layout, either 'loose' (one file per hash) or 'pack' (single append-only pack file)
+        """
         self.dbfile = dbfile
         self.conn = sqlite3.connect(self.dbfile)
         self.lastcur = None
         self.datastore_path = datastore
-        if not os.path.isdir(self.datastore_path):
-            os.makedirs(self.datastore_path)
-            self.create_buckets()
-        hasher = hashlib.md5()
+        self.store = open_datastore(self.datastore_path, backend)
     
     def hash_data(self, data):
         return hash_data(data)
     
-    def __hash_path(self, fhash):
-        bucket = fhash[0:4]
-        return os.path.join(self.datastore_path, bucket, fhash)
-    
     def get_file_path(self, fhash, silent=False):
-        fpath = self.__hash_path(fhash)
-        if not os.path.isfile(fpath):
-            raise FileExistsError("Error -- the file with the given hash does not exist in the datastore")
-
-        return fpath
+        return self.store.get_file_path(fhash)
+    
+    def get_data(self, fhash):
+        """
+        Returns the raw bytes stored in the datastore under the given hash
+        """
+        return self.store.get(fhash)
     
     def create_buckets(self):
         """
-        Creates the bucket structure within the datastore
+        Creates the bucket structure within the datastore (loose backend only)
         """
-        from itertools import product
-        charlist = list(map(lambda x: str(x), [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 'a', 'b', 'c', 'd', 'e', 'f']))
-        buckets = list(product(*[charlist] * 4))
-        buckets = list(map(lambda x: ''.join(x), buckets))
-
-        for bucket in buckets:
-            if not os.path.isdir(os.path.join(self.datastore_path, bucket)):
-                os.makedirs(os.path.join(self.datastore_path, bucket))
+        self.store.create_buckets()
+    
+    def compact_datastore(self, background=True):
+        """
+        Reclaims space from removed entries -- only meaningful for the pack backend
+        """
+        if isinstance(self.store, PackFileStore):
+            return self.store.compact(background)
+        print("Datastore backend does not need compaction")
+        
+    def close(self):
+        self.store.close()
+        self.conn.close()
         
     def initdb(self):
         try:
@@ -70,19 +77,26 @@ class QueryDatabase:
         
         print("Database is ready")
         
-    def save_qd(self, querydoc):
-        if isinstance(querydoc.da, MatchArray):
-            keystr = querydoc.da[0].text
+    @staticmethod
+    def query_row(da):
+        """
+        Returns the (query text, bytes, hash) that gets stored for a document's data -- one row per
+        grid, keyed on the text of the first tile
+        """
+        if isinstance(da, DocumentArray):
+            keystr = da[0].text
         else:
-            keystr = querydoc.da.text
+            keystr = da.text
             
-        qdbytes = querydoc.da.to_bytes()
-        qdhash = self.hash_data(qdbytes)
+        qdbytes = da.to_bytes()
+        return keystr, qdbytes, hash_data(qdbytes)
+        
+    def save_qd(self, querydoc):
+        keystr, qdbytes, qdhash = self.query_row(querydoc.da)
         self.conn.execute(f"INSERT INTO QUERIES (INQUERY, FILEHASH) VALUES (\"{keystr}\",\"{qdhash}\")")
         self.conn.commit()
         
-        with open(self.__hash_path(qdhash),"wb") as ofile:
-            ofile.write(qdbytes)
+        self.store.put(qdhash, qdbytes)
             
     def save_session(self, session_name, qs):
         if self.__get_session_hash(session_name) is not None:
@@ -95,8 +109,7 @@ class QueryDatabase:
         
         print(f"Session {session_name} saved to database")
         
-        with open(self.__hash_path(sHash),"wb") as ofile:
-            ofile.write(all_bytes)
+        self.store.put(sHash, all_bytes)
             
     def replace_session(self, session_name, newQS):
         shash = self.__get_session_hash(session_name)
@@ -112,22 +125,32 @@ class QueryDatabase:
             return
         self.conn.execute(f"DELETE FROM SESSIONS WHERE FILEHASH = \"{shash}\"")
         self.conn.commit()
+        self.__release_hash(shash)
         print(f"Session {session_name} removed from database")
         
-    def load_session(self, session_name):
+    def load_session(self, session_name, speculator=None):
         from .session import QuerySession
         shash = self.__get_session_hash(session_name)
         if shash is None:
             raise ValueError(f"session name [{session_name}] does not exist in the database")
         
-        with open(self.get_file_path(shash),"rb") as infile:
-            data = infile.read()
-        list
-        newS = QuerySession(self)
+        data = self.get_data(shash)
+        newS = QuerySession(self, speculator=speculator)
         newS.from_bytes(data)
+        newS.speculate_on()
         return newS
         
         
+    def __release_hash(self, fhash):
+        # Only the pack backend marks removed data so compaction can reclaim it -- loose files are
+        # never deleted. Only drop the data once nothing in the database refers to it anymore
+        if not isinstance(self.store, PackFileStore):
+            return
+        nrefs = self.conn.execute(f"SELECT COUNT(*) FROM SESSIONS WHERE FILEHASH = \"{fhash}\"").fetchone()[0]
+        nrefs += self.conn.execute(f"SELECT COUNT(*) FROM QUERIES WHERE FILEHASH = \"{fhash}\"").fetchone()[0]
+        if nrefs == 0:
+            self.store.delete(fhash)
+        
     def __get_session_hash(self, session_name):
         hashlist = self.conn.execute(f"SELECT * FROM SESSIONS WHERE SESSIONNAME = \"{session_name}\"").fetchall()
         if len(hashlist) == 0:
@@ -159,8 +182,7 @@ class QueryDatabase:
         
             
     def rebuild_doc(self, fhash, dalle_flow_endpoint="grpc://10.10.28.110:51005"):
-        fpath = self.get_file_path(fhash)
-        with open(fpath, 'rb') as infile:
-            data = infile.read()
+        from .document import QueryDocument
+        data = self.get_data(fhash)
         newda = Document().from_bytes(data)
         return QueryDocument(da=newda,url=dalle_flow_endpoint)
\ No newline at end of file
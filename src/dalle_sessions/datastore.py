@@ -0,0 +1,401 @@
+import os
+import mmap
+import fcntl
+import threading
+from contextlib import contextmanager
+from itertools import product
+
+
+class LooseFileStore:
+    """
+    The original datastore layout -- one file per hash, organized into buckets named after
+    the first four hex characters of the hash
+    """
+
+    def __init__(self, datastore_path):
+        self.datastore_path = datastore_path
+        if not os.path.isdir(self.datastore_path):
+            os.makedirs(self.datastore_path)
+            self.create_buckets()
+
+    def create_buckets(self):
+        """
+        Creates the bucket structure within the datastore
+        """
+        charlist = list(map(lambda x: str(x), [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 'a', 'b', 'c', 'd', 'e', 'f']))
+        buckets = list(product(*[charlist] * 4))
+        buckets = list(map(lambda x: ''.join(x), buckets))
+
+        for bucket in buckets:
+            if not os.path.isdir(os.path.join(self.datastore_path, bucket)):
+                os.makedirs(os.path.join(self.datastore_path, bucket))
+
+    def hash_path(self, fhash):
+        bucket = fhash[0:4]
+        return os.path.join(self.datastore_path, bucket, fhash)
+
+    def get_file_path(self, fhash):
+        fpath = self.hash_path(fhash)
+        if not os.path.isfile(fpath):
+            raise FileExistsError("Error -- the file with the given hash does not exist in the datastore")
+        return fpath
+
+    def has(self, fhash):
+        return os.path.isfile(self.hash_path(fhash))
+
+    def put(self, fhash, data):
+        fpath = self.hash_path(fhash)
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        with open(fpath, "wb") as ofile:
+            ofile.write(data)
+
+    def get(self, fhash):
+        with open(self.get_file_path(fhash), "rb") as infile:
+            return infile.read()
+
+    def delete(self, fhash):
+        if self.has(fhash):
+            os.remove(self.hash_path(fhash))
+
+    def keys(self):
+        for bucket in sorted(os.listdir(self.datastore_path)):
+            bpath = os.path.join(self.datastore_path, bucket)
+            if not os.path.isdir(bpath):
+                continue
+            for fhash in sorted(os.listdir(bpath)):
+                yield fhash
+
+    def close(self):
+        pass
+
+
+class PackFileStore:
+    """
+    Append-only datastore -- all blobs live in a single pack file and an index file maps each
+    hash to its (offset, length) in the pack. Reads go through an mmap of the pack.
+
+    Files in the datastore folder:
+        CURRENT -- the name of the active pack generation (swapped atomically on compaction)
+        pack-<gen>.dat -- the blob data, appended to on every put
+        pack-<gen>.idx -- one line per put or delete: `<hash> <offset> <length>`, deletes use offset -1
+        LOCK -- held shared by every open store, compaction needs it exclusively
+        WRITE.lock -- held exclusively around each put / delete
+
+    Several stores (e.g. a notebook session and the ingest cli) can have the same pack open at
+    once -- writes are serialized through WRITE.lock and each store picks up the index entries
+    written by the others before it writes or when it misses a hash.
+    """
+
+    def __init__(self, datastore_path):
+        self.datastore_path = datastore_path
+        if not os.path.isdir(self.datastore_path):
+            os.makedirs(self.datastore_path)
+        self.lock = threading.RLock()
+        self.compact_thread = None
+        self.index = {}
+        self.index_pos = 0
+        self.dead_bytes = 0
+        self.mm = None
+        self.lock_file = open(os.path.join(self.datastore_path, "LOCK"), "a")
+        self.write_lock_file = open(os.path.join(self.datastore_path, "WRITE.lock"), "a")
+        # Blocks while another process is compacting the pack
+        fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_SH)
+        self.generation = self.__read_current()
+        self.__open_generation(self.generation)
+
+    def __current_path(self):
+        return os.path.join(self.datastore_path, "CURRENT")
+
+    def __pack_path(self, gen):
+        return os.path.join(self.datastore_path, f"pack-{gen:05d}.dat")
+
+    def __index_path(self, gen):
+        return os.path.join(self.datastore_path, f"pack-{gen:05d}.idx")
+
+    def __read_current(self):
+        with self.__write_lock():
+            if not os.path.isfile(self.__current_path()):
+                self.__write_current(0)
+                return 0
+        with open(self.__current_path(), "r") as infile:
+            return int(infile.read().strip())
+
+    def __write_current(self, gen):
+        tmp = self.__current_path() + ".tmp"
+        with open(tmp, "w") as ofile:
+            ofile.write(str(gen))
+            ofile.flush()
+            os.fsync(ofile.fileno())
+        os.replace(tmp, self.__current_path())
+
+    @contextmanager
+    def __write_lock(self):
+        fcntl.flock(self.write_lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.write_lock_file.fileno(), fcntl.LOCK_UN)
+
+    def __open_generation(self, gen):
+        self.index = {}
+        self.index_pos = 0
+        self.dead_bytes = 0
+        self.pack_file = open(self.__pack_path(gen), "ab+")
+        self.index_file = open(self.__index_path(gen), "a")
+        self.mm = None
+        self.__refresh()
+
+    def __refresh(self):
+        """
+        Applies any index entries appended since we last read the index file (by us or by another store)
+        """
+        with open(self.__index_path(self.generation), "r") as infile:
+            infile.seek(self.index_pos)
+            while True:
+                line = infile.readline()
+                # A partially written trailing line is either a put in progress or a crash mid-put --
+                # leave it for the next refresh
+                if not line.endswith("\n"):
+                    break
+                self.index_pos = infile.tell()
+                parts = line.split()
+                if len(parts) != 3:
+                    continue
+                fhash, offset, length = parts[0], int(parts[1]), int(parts[2])
+                if fhash in self.index:
+                    self.dead_bytes += self.index[fhash][1]
+                if offset < 0:
+                    self.index.pop(fhash, None)
+                else:
+                    self.index[fhash] = (offset, length)
+
+    def __remap(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        if os.fstat(self.pack_file.fileno()).st_size > 0:
+            self.mm = mmap.mmap(self.pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def has(self, fhash):
+        with self.lock:
+            if fhash not in self.index:
+                self.__refresh()
+            return fhash in self.index
+
+    def get_file_path(self, fhash):
+        raise TypeError("the pack datastore does not store blobs as individual files -- use get() to read the data")
+
+    def put(self, fhash, data):
+        with self.lock, self.__write_lock():
+            self.__refresh()
+            if fhash in self.index:
+                return
+            self.__repair_index()
+            # The offset has to come from the file itself -- another store may have appended since we last wrote
+            self.pack_file.seek(0, os.SEEK_END)
+            offset = self.pack_file.tell()
+            self.pack_file.write(data)
+            self.pack_file.flush()
+            os.fsync(self.pack_file.fileno())
+            self.__append_index(f"{fhash} {offset} {len(data)}\n")
+
+    def get(self, fhash):
+        with self.lock:
+            if fhash not in self.index:
+                self.__refresh()
+            if fhash not in self.index:
+                raise FileExistsError("Error -- the file with the given hash does not exist in the datastore")
+            offset, length = self.index[fhash]
+            if self.mm is None or offset + length > len(self.mm):
+                self.__remap()
+            return self.mm[offset:offset + length]
+
+    def delete(self, fhash):
+        with self.lock, self.__write_lock():
+            self.__refresh()
+            if fhash not in self.index:
+                return
+            self.__repair_index()
+            self.__append_index(f"{fhash} -1 0\n")
+
+    def __append_index(self, line):
+        self.index_file.write(line)
+        self.index_file.flush()
+        os.fsync(self.index_file.fileno())
+        self.__refresh()
+
+    def __repair_index(self):
+        """
+        Cuts off a partially written trailing index line left behind by a crash mid-write, otherwise
+        the next entry would be appended onto it and lost. Must be called holding WRITE.lock
+        """
+        ipath = self.__index_path(self.generation)
+        size = os.path.getsize(ipath)
+        if size == 0:
+            return
+        with open(ipath, "rb+") as infile:
+            infile.seek(size - 1)
+            if infile.read(1) == b"\n":
+                return
+            pos = size
+            while pos > 0:
+                start = max(0, pos - 4096)
+                infile.seek(start)
+                chunk = infile.read(pos - start)
+                nl = chunk.rfind(b"\n")
+                if nl >= 0:
+                    pos = start + nl + 1
+                    break
+                pos = start
+            infile.truncate(pos)
+
+    def keys(self):
+        with self.lock:
+            self.__refresh()
+            return sorted(self.index.keys())
+
+    def compact(self, background=True):
+        """
+        Rewrites the live blobs into a fresh pack generation, dropping deleted data.
+
+        Compaction needs the pack to itself -- it is refused while any other store has the same
+        datastore open. The copy runs without holding the store lock (existing blobs never move in an
+        append-only pack), so reads and writes from this process keep working while compaction is in
+        progress. Anything written during the copy is carried over before the new generation is swapped in.
+
+        Parameters:
+            background:bool -- run the compaction on a background thread and return immediately
+        """
+        if self.compact_thread is not None and self.compact_thread.is_alive():
+            print("Compaction is already running")
+            return self.compact_thread
+
+        try:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # A failed upgrade has already dropped our shared lock on Linux -- take it back, and pick up a
+            # new generation in case someone else compacted while we were not holding it
+            self.__reacquire_shared()
+            print("Cannot compact -- the datastore is open somewhere else, close the other sessions first")
+            return None
+
+        if background:
+            self.compact_thread = threading.Thread(target=self.__compact, daemon=True)
+            self.compact_thread.start()
+            return self.compact_thread
+
+        self.__compact()
+
+    def __reacquire_shared(self):
+        fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_SH)
+        with self.lock:
+            gen = self.__read_current()
+            if gen != self.generation:
+                self.__close_files()
+                self.generation = gen
+                self.__open_generation(gen)
+
+    def __compact(self):
+        try:
+            self.__compact_locked()
+        finally:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_SH)
+
+    def __compact_locked(self):
+        with self.lock:
+            self.__refresh()
+            old_gen = self.generation
+            snapshot = dict(self.index)
+            reclaimed = self.dead_bytes
+
+        new_gen = old_gen + 1
+        new_index = {}
+        with open(self.__pack_path(old_gen), "rb") as src, \
+                open(self.__pack_path(new_gen), "wb") as dst, \
+                open(self.__index_path(new_gen), "w") as idx:
+            new_offset = 0
+
+            def copy_blob(fhash, offset, length):
+                nonlocal new_offset
+                src.seek(offset)
+                dst.write(src.read(length))
+                idx.write(f"{fhash} {new_offset} {length}\n")
+                new_index[fhash] = (new_offset, length)
+                new_offset += length
+
+            for fhash, (offset, length) in sorted(snapshot.items(), key=lambda x: x[1][0]):
+                copy_blob(fhash, offset, length)
+
+            with self.lock:
+                # Catch up on everything that changed while we were copying, then swap under the lock
+                self.pack_file.flush()
+                for fhash, (offset, length) in sorted(self.index.items(), key=lambda x: x[1][0]):
+                    if fhash not in new_index:
+                        copy_blob(fhash, offset, length)
+                for fhash in list(new_index.keys()):
+                    if fhash not in self.index:
+                        idx.write(f"{fhash} -1 0\n")
+                        new_index.pop(fhash)
+
+                dst.flush()
+                os.fsync(dst.fileno())
+                idx.flush()
+                os.fsync(idx.fileno())
+                self.__close_files()
+                self.__write_current(new_gen)
+                self.generation = new_gen
+                self.__open_generation(new_gen)
+
+        os.remove(self.__pack_path(old_gen))
+        os.remove(self.__index_path(old_gen))
+        print(f"Compaction finished -- reclaimed {reclaimed} bytes")
+
+    def __close_files(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.pack_file.close()
+        self.index_file.close()
+
+    def close(self):
+        if self.compact_thread is not None:
+            self.compact_thread.join()
+        with self.lock:
+            self.__close_files()
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.write_lock_file.close()
+
+
+DATASTORE_BACKENDS = {
+    'loose': LooseFileStore,
+    'pack': PackFileStore,
+}
+
+
+def open_datastore(datastore_path, backend="loose"):
+    if backend not in DATASTORE_BACKENDS:
+        raise ValueError(f"unknown datastore backend [{backend}] -- expected one of {list(DATASTORE_BACKENDS.keys())}")
+    return DATASTORE_BACKENDS[backend](datastore_path)
+
+
+def convert_datastore(src_path, dst_path, src_backend="loose", dst_backend="pack"):
+    """
+    Copies every blob from one datastore into another, e.g. to move an existing loose-file
+    datastore into a pack file. The source datastore is left untouched.
+    """
+    if not os.path.isdir(src_path):
+        raise FileNotFoundError(f"source datastore [{src_path}] does not exist")
+    src = open_datastore(src_path, src_backend)
+    dst = open_datastore(dst_path, dst_backend)
+    count = 0
+    try:
+        for fhash in src.keys():
+            if not dst.has(fhash):
+                dst.put(fhash, src.get(fhash))
+                count += 1
+    finally:
+        src.close()
+        dst.close()
+    print(f"Copied {count} files from {src_path} [{src_backend}] to {dst_path} [{dst_backend}]")
+    return count
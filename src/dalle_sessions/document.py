@@ -10,6 +10,7 @@ import re
 import matplotlib.pyplot as plt
 import numpy as np
 from .utils import hash_data
+from .compositor import compose_docs, save_array, show_array
     
 class QueryDocument:
     def __init__(self,url="grpc://10.10.28.110:51005", da=None):
@@ -60,17 +61,29 @@ class QueryDocument:
             bb = str(ff.readline())
         self.da = Document().from_base64(bb)
         
-    def show_tiles(self):
+    def grid_image(self, scale=1.0, show_index=False):
+        """
+        Returns the tiles of the document composed into a single image array
+        
+        Parameters:
+            scale:float -- downscale factor applied to every tile
+            show_index:bool -- draw the index of each tile on the grid
+        """
+        if isinstance(self.da, MatchArray):
+            return compose_docs(self.da, scale=scale, show_index=show_index)
+        return compose_docs([self.da], scale=scale)
+        
+    def show_tiles(self, scale=1.0):
         if isinstance(self.da, MatchArray):
-            self.da.plot_image_sprites(fig_size=(15,15),show_index=True)
+            show_array(self.grid_image(scale, show_index=True))
         else:
             self.da.display()
     
-    def save_grid(self, outfile):
+    def save_grid(self, outfile, scale=1.0):
         if not isinstance(self.da, MatchArray):
             self.save_image(outfile)
         else:
-            self.da.plot_image_sprites(outfile)
+            save_array(self.grid_image(scale), outfile)
     
     def save_image(self, outfile, idx=0):
         if isinstance(self.da, MatchArray):
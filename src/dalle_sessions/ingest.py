@@ -0,0 +1,155 @@
+"""
+Bulk import of existing query documents into a QueryDatabase.
+
+Two kinds of files are understood:
+    base64 files written by `QueryDocument.to_base64_file`
+    binary DocumentArray dumps (`DocumentArray.save_binary`)
+
+Every file becomes one row, exactly as `QueryDatabase.save_qd` would have stored it.
+
+Usage:
+    python -m dalle_sessions.ingest [--db queries.db] [--datastore db_datastore] [--backend loose] FILE_OR_FOLDER [...]
+"""
+import os
+import re
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from docarray import Document, DocumentArray
+from docarray.array.match import MatchArray
+from .utils import hash_data
+from .database import QueryDatabase
+
+_BASE64_RE = re.compile(rb"[A-Za-z0-9+/=\r\n]*")
+
+
+def _decode_file(path):
+    """
+    Runs in a worker process -- returns the (query text, bytes, hash) row for the file
+    """
+    with open(path, "rb") as infile:
+        head = infile.read(64)
+
+    if _BASE64_RE.fullmatch(head):
+        with open(path, "r") as ff:
+            bb = str(ff.readline())
+        # Grids (query / diffuse results) are written as a match array, upscales as a single document
+        try:
+            da = DocumentArray.from_base64(bb)
+        except Exception:
+            da = Document().from_base64(bb)
+    else:
+        da = DocumentArray.load_binary(path)
+
+    return QueryDatabase.query_row(_as_grid(da))
+
+
+def _as_grid(da):
+    # QueryDocument only treats a MatchArray as a grid -- attach plain arrays (e.g. raw dumps) as the
+    # matches of their query so the imported row can be used in a session. The query gets an id derived
+    # from the content so the same dump always produces the same bytes (and dedups against itself)
+    if isinstance(da, DocumentArray) and not isinstance(da, MatchArray):
+        return Document(id=hash_data(da.to_bytes()), text=da[0].text, matches=da).matches
+    return da
+
+
+def _expand_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for fname in sorted(files):
+                    yield os.path.join(root, fname)
+        else:
+            yield path
+
+
+def ingest_files(qdb:QueryDatabase, paths, workers=None, batch_size=500, max_pending=None):
+    """
+    Imports query documents from files into the database.
+
+    Files are decoded and hashed in a process pool, documents already in the database (or seen
+    earlier in the same import) are skipped, and the new rows are inserted one batch per transaction.
+    At most `max_pending` files are decoded ahead of the writer and each document's data is written
+    to the datastore as soon as it arrives, so memory stays bounded.
+
+    Parameters:
+        qdb:QueryDatabase -- the database to import into
+        paths:list -- files, or folders which are searched recursively
+        workers:int -- number of decoding processes, defaults to the number of cpus
+        batch_size:int -- number of rows inserted per transaction
+        max_pending:int -- number of files being decoded at once, defaults to 4 per worker
+
+    Returns a dict with the number of files read, documents added, duplicates and failed files
+    """
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 4
+    seen = set(r[0] for r in qdb.conn.execute("SELECT FILEHASH FROM QUERIES").fetchall())
+    stats = {'files': 0, 'added': 0, 'duplicates': 0, 'failed': 0}
+    batch = []
+
+    def flush():
+        with qdb.conn:
+            qdb.conn.executemany("INSERT INTO QUERIES (INQUERY, FILEHASH) VALUES (?, ?)", batch)
+        stats['added'] += len(batch)
+        batch.clear()
+
+    path_iter = _expand_paths(paths)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+
+        def fill():
+            while len(pending) < max_pending:
+                path = next(path_iter, None)
+                if path is None:
+                    return
+                pending[pool.submit(_decode_file, path)] = path
+
+        fill()
+        while len(pending) > 0:
+            done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                stats['files'] += 1
+                try:
+                    text, dbytes, dhash = future.result()
+                except Exception as e:
+                    print(f"Failed to read {path}: {e}")
+                    stats['failed'] += 1
+                    continue
+                if dhash in seen:
+                    stats['duplicates'] += 1
+                    continue
+                seen.add(dhash)
+                # Only the (text, hash) rows wait for the transaction -- the data goes to the datastore now
+                qdb.store.put(dhash, dbytes)
+                batch.append((text, dhash))
+                if len(batch) >= batch_size:
+                    flush()
+            fill()
+
+    if len(batch) > 0:
+        flush()
+
+    print(f"Imported {stats['added']} documents from {stats['files']} files -- {stats['duplicates']} duplicates skipped, {stats['failed']} files failed")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import query documents into a dalle_sessions database")
+    parser.add_argument("paths", nargs="+", help="files or folders to import")
+    parser.add_argument("--db", default="queries.db", help="sqlite database file")
+    parser.add_argument("--datastore", default="db_datastore", help="datastore folder")
+    parser.add_argument("--backend", default="loose", choices=["loose", "pack"], help="datastore backend")
+    parser.add_argument("--workers", type=int, default=None, help="number of decoding processes")
+    parser.add_argument("--batch-size", type=int, default=500, help="rows inserted per transaction")
+    args = parser.parse_args(argv)
+
+    qdb = QueryDatabase(args.db, args.datastore, args.backend)
+    qdb.initdb()
+    try:
+        ingest_files(qdb, args.paths, workers=args.workers, batch_size=args.batch_size)
+    finally:
+        qdb.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ from docarray.array.match import MatchArray
 import sqlite3
 import os
 import io
+import copy
 import hashlib
 import tempfile
 import PIL.Image
@@ -12,6 +13,8 @@ import numpy as np
 from .utils import hash_data
 from .database import QueryDatabase
 from .document import QueryDocument
+from .speculate import SpeculativeCache
+from .compositor import doc_to_array, compose_strip, show_array
 
 class QueryDocNode:
     def __init__(self, doc, parent, children):
@@ -51,9 +54,17 @@ class QueryDocNode:
 
 class QuerySession:  
     
-    def __init__(self, qdb:QueryDatabase, dalle_url="grpc://10.10.28.110:51005"):
+    def __init__(self, qdb:QueryDatabase, dalle_url="grpc://10.10.28.110:51005", speculator:SpeculativeCache=None):
+        """
+        Parameters:
+            qdb:QueryDatabase -- database used to save and load documents
+            dalle_url:str -- the dalle-flow endpoint
+            speculator:SpeculativeCache -- optional, when given diffuse / upscale requests for the tiles
+                of the current grid are issued in the background while you browse
+        """
         self.qdb = qdb
         self.dalle_url = dalle_url
+        self.speculator = speculator
         self.cur_doc = None
         self.document_stack = []
         self.stack_idx = None
@@ -74,6 +85,7 @@ class QuerySession:
         self.document_stack.append(self.cur_doc)
         self.unsaved_changes = True
         self.show()
+        self.speculate_on()
         
     def __check_valid_doc(self):
         if self.cur_doc is None:
@@ -95,7 +107,10 @@ class QuerySession:
         
         self.__check_valid_doc()
         
-        diffuse_doc = QueryDocNode(self.cur_doc.doc.diffuse(skip_rate, idx), self.cur_doc, [])
+        newdoc = self.__speculative_result('diffuse', idx, skip_rate)
+        if newdoc is None:
+            newdoc = self.cur_doc.doc.diffuse(skip_rate, idx)
+        diffuse_doc = QueryDocNode(newdoc, self.cur_doc, [])
         
         self.cur_doc.add_child(diffuse_doc)
         self.document_stack.append(diffuse_doc)
@@ -103,6 +118,31 @@ class QuerySession:
         self.prev_stack_idx = self.stack_idx
         self.stack_idx = len(self.document_stack)-1
         self.show()
+        self.speculate_on()
+        
+    def speculate_on(self, idxs=None):
+        """
+        Starts speculative requests for the tiles of the current document -- does nothing unless the
+        session was created with a speculator
+        
+        Parameters:
+            idxs:list -- tile indices in order of preference, defaults to the tiles in grid order -- when
+                given, queued requests for other tiles are dropped in favour of these
+        """
+        if self.speculator is None or self.cur_doc is None:
+            return
+        if not isinstance(self.cur_doc.doc.da, MatchArray):
+            self.speculator.discard()
+            return
+        if idxs is None:
+            self.speculator.speculate(self.cur_doc.doc, range(len(self.cur_doc.doc.da)))
+        else:
+            self.speculator.speculate(self.cur_doc.doc, idxs, reprioritize=True)
+        
+    def __speculative_result(self, op, idx, skip_rate=None):
+        if self.speculator is None:
+            return None
+        return self.speculator.take(self.cur_doc.doc, op, idx, skip_rate)
         
     def save_current(self):
         """
@@ -118,6 +158,7 @@ class QuerySession:
         self.document_stack = []
         self.cur_doc = QueryDocNode(self.qdb.rebuild_doc(fhash, self.dalle_url),None,[])
         self.document_stack.append(self.cur_doc)
+        self.speculate_on()
         return       
     
     def set_current_doc(self, doc):
@@ -126,32 +167,25 @@ class QuerySession:
         else:
             self.cur_doc = QueryDocNode(doc,None,[])
         self.document_stack = [self.cur_doc]
+        self.speculate_on()
         
         
-    def display_path(self):
+    def display_path(self, scale=1.0):
         self.__check_valid_doc()
         stt = self.cur_doc.doc.get_text()
         idxs = list(map(lambda x: x.split('item')[1].strip('[').strip(']'), re.findall(r"item\[[0-9]*\]",stt)))
         idxs.reverse()
-        with tempfile.TemporaryDirectory() as tdir:
-            ofilepath = os.path.join(tdir,'tmp.png')
-            parent = self.cur_doc.parent
-            imgs = []
-            for ii in idxs:
-                parent.doc.da[int(ii)].save_uri_to_file(ofilepath)
-                pp = PIL.Image.open(ofilepath)
-                imgs.append(np.array(pp))
-                parent = parent.parent
-            imgs.reverse()
+        parent = self.cur_doc.parent
+        imgs = []
+        for ii in idxs:
+            imgs.append(doc_to_array(parent.doc.da[int(ii)]))
+            parent = parent.parent
+        imgs.reverse()
 
-        fig, ax = plt.subplots(1,len(imgs),figsize=(40,40))
-        for i in range(len(imgs)):
-            ax[i].imshow(imgs[i])
-            ax[i].set_axis_off()
-        plt.show()
+        show_array(compose_strip(imgs, scale=scale))
     
     def fork(self):
-        newS = QuerySession(self.qdb,self.dalle_url)
+        newS = QuerySession(self.qdb,self.dalle_url,None if self.speculator is None else self.speculator.clone())
         newS.cur_doc = copy.deepcopy(self.cur_doc)
         newS.document_stack = copy.deepcopy(self.document_stack)
         newS.unsaved_changes = self.unsaved_changes
@@ -194,6 +228,16 @@ class QuerySession:
     def reset_graph(self):
         self.cur_doc = None
         self.document_stack = []
+        if self.speculator is not None:
+            self.speculator.discard()
+        
+    def close(self):
+        """
+        Stops speculative work for this session -- call this when you are done with the session
+        """
+        if self.speculator is not None:
+            self.speculator.shutdown()
+            self.speculator = None
         
     def show(self):
         print(self.cur_doc.doc.get_text())
@@ -208,6 +252,7 @@ class QuerySession:
             return
         
         print(f"Active Document: {self.cur_doc.doc.get_text()}")
+        self.speculate_on()
             
         #TODO: Set the stack_idx and prev_stack_idx correctly when doing this up operation
     
@@ -226,6 +271,7 @@ class QuerySession:
             self.cur_doc = self.cur_doc.active_child
             
         print(f"Active Document: {self.cur_doc.doc.get_text()}")
+        self.speculate_on()
             
     def back(self):
         self.__check_valid_doc()
@@ -240,6 +286,7 @@ class QuerySession:
         self.stack_idx -= 1
         self.cur_doc = self.document_stack[self.stack_idx]
         print(f"Active Document: {self.cur_doc.doc.get_text()}")
+        self.speculate_on()
         
     def forward(self):
         self.__check_valid_doc()
@@ -251,6 +298,7 @@ class QuerySession:
         self.stack_idx += 1
         self.cur_doc = self.document_stack[self.stack_idx]
         print(f"Active Document: {self.cur_doc.doc.get_text()}")
+        self.speculate_on()
         
     def prev(self):
         self.__check_valid_doc()
@@ -260,6 +308,7 @@ class QuerySession:
         self.stack_idx = tmp
         self.cur_doc = self.document_stack[self.stack_idx]
         print(f"Active Document: {self.cur_doc.doc.get_text()}")
+        self.speculate_on()
         
     def set_stack_position(self, idx):
         if idx >= len(self.document_stack):
@@ -267,6 +316,7 @@ class QuerySession:
             
         self.cur_doc = self.document_stack[idx]
         print(f"Active Document: {self.cur_doc.doc.get_text()}")
+        self.speculate_on()
         
     def goto_root(self):
         self.set_stack_position(0)
@@ -279,7 +329,10 @@ class QuerySession:
                 
     def upscale(self, idx):
         self.__check_valid_doc()
-        upscale_doc = QueryDocNode(self.cur_doc.doc.upscale(idx),self.cur_doc,[])
+        newdoc = self.__speculative_result('upscale', idx)
+        if newdoc is None:
+            newdoc = self.cur_doc.doc.upscale(idx)
+        upscale_doc = QueryDocNode(newdoc,self.cur_doc,[])
         self.cur_doc.add_child(upscale_doc)
         self.document_stack.append(upscale_doc)
         
@@ -287,6 +340,7 @@ class QuerySession:
         self.prev_stack_idx = self.stack_idx
         self.stack_idx = len(self.document_stack)-1
         self.show()
+        self.speculate_on()
         
     def show_graph(self):
         root_node = self.document_stack[0]
@@ -0,0 +1,117 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SpeculativeCache:
+    """
+    Issues diffuse / upscale requests in the background for the tiles we are likely to pick next,
+    so that when the matching call is made the result is (hopefully) already waiting.
+
+    Parameters:
+        max_workers:int -- number of speculative requests allowed in flight at once
+        budget:int -- maximum number of speculative results (pending or finished) held at any time
+        skip_rate:float -- skip rate used for speculative diffusions
+        ops:tuple -- which operations to speculate on, any of 'diffuse' and 'upscale'
+    """
+
+    def __init__(self, max_workers=2, budget=4, skip_rate=0.5, ops=('diffuse',)):
+        for op in ops:
+            if op not in ('diffuse', 'upscale'):
+                raise ValueError(f"cannot speculate on operation [{op}]")
+        self.max_workers = max_workers
+        self.budget = budget
+        self.skip_rate = skip_rate
+        self.ops = tuple(ops)
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.results = {}
+        self.hits = 0
+        self.misses = 0
+        self.closed = False
+
+    def clone(self):
+        """
+        Returns a new, empty cache with the same settings -- e.g. for a forked session
+        """
+        return SpeculativeCache(self.max_workers, self.budget, self.skip_rate, self.ops)
+
+    def __key(self, doc, op, idx, skip_rate=None):
+        return (doc.get_hash(), op, int(idx), skip_rate if op == 'diffuse' else None)
+
+    def speculate(self, doc, candidates, reprioritize=False):
+        """
+        Discards results that do not belong to `doc` and starts speculative requests for the
+        candidate tile indices, in order, until the budget is used up
+
+        Parameters:
+            doc:QueryDocument -- the grid to speculate on
+            candidates:list -- tile indices in order of preference
+            reprioritize:bool -- the candidates replace the current priorities for `doc`: requests that
+                have not started yet are requeued in candidate order and results for other tiles are
+                dropped to free up the budget
+        """
+        dhash = doc.get_hash()
+        candidates = [int(idx) for idx in candidates]
+        with self.lock:
+            if self.closed:
+                return
+            for key in list(self.results.keys()):
+                if key[0] != dhash:
+                    self.results.pop(key).cancel()
+                elif reprioritize:
+                    future = self.results[key]
+                    if future.cancel() or (future.done() and key[2] not in candidates):
+                        self.results.pop(key)
+
+            for idx in candidates:
+                for op in self.ops:
+                    if len(self.results) >= self.budget:
+                        return
+                    key = self.__key(doc, op, idx, self.skip_rate)
+                    if key in self.results:
+                        continue
+                    if op == 'diffuse':
+                        self.results[key] = self.pool.submit(doc.diffuse, self.skip_rate, idx)
+                    else:
+                        self.results[key] = self.pool.submit(doc.upscale, idx)
+
+    def take(self, doc, op, idx, skip_rate=None):
+        """
+        Returns the speculative result for the given operation, waiting on it if it is already running --
+        returns None if nothing was speculated, the request had not started yet or it failed
+        """
+        with self.lock:
+            if self.closed:
+                return None
+            future = self.results.pop(self.__key(doc, op, idx, skip_rate), None)
+        # If the request is still queued behind other speculative work it is faster to run it directly
+        if future is None or future.cancel():
+            self.misses += 1
+            return None
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Speculative {op} of item[{idx}] failed ({e}) -- running it again")
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def discard(self):
+        """
+        Drops every speculative result and cancels the requests that have not started yet
+        """
+        with self.lock:
+            for future in self.results.values():
+                future.cancel()
+            self.results = {}
+
+    def shutdown(self):
+        """
+        Drops every result and stops the worker threads -- requests already running on the GPU are
+        left to finish in the background. Afterwards speculate() and take() do nothing
+        """
+        self.discard()
+        with self.lock:
+            self.closed = True
+        self.pool.shutdown(wait=False, cancel_futures=True)
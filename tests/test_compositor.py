@@ -0,0 +1,42 @@
+import io
+import base64
+from types import SimpleNamespace
+
+import numpy as np
+import PIL.Image
+import pytest
+
+from dalle_sessions.compositor import doc_to_array, compose_grid, compose_strip
+
+
+def _png(arr):
+    buf = io.BytesIO()
+    PIL.Image.fromarray(arr).save(buf, "png")
+    return buf.getvalue()
+
+
+def test_doc_to_array_sources():
+    img = np.random.randint(0, 255, (8, 8, 3), dtype=np.uint8)
+    uri = "data:image/png;base64," + base64.b64encode(_png(img)).decode()
+    assert (doc_to_array(SimpleNamespace(tensor=None, uri=uri, blob=b"")) == img).all()
+    assert (doc_to_array(SimpleNamespace(tensor=None, uri="", blob=_png(img))) == img).all()
+    assert (doc_to_array(SimpleNamespace(tensor=img, uri="", blob=b"")) == img).all()
+
+
+def test_doc_to_array_nothing_to_render():
+    with pytest.raises(ValueError):
+        doc_to_array(SimpleNamespace(tensor=None, uri="", blob=b""))
+
+
+def test_float_tensor_in_unit_range_is_scaled():
+    tensor = np.random.rand(8, 8, 3).astype(np.float32)
+    arr = doc_to_array(SimpleNamespace(tensor=tensor, uri="", blob=b""))
+    assert arr.dtype == np.uint8
+    assert arr.max() > 200
+
+
+def test_compose_grid_shape():
+    imgs = [np.zeros((16, 16, 3), dtype=np.uint8) for _ in range(9)]
+    assert compose_grid(imgs, padding=2).shape == (3 * 16 + 4 * 2, 3 * 16 + 4 * 2, 3)
+    assert compose_grid(imgs, padding=0, scale=0.5, show_index=True).shape == (24, 24, 3)
+    assert compose_strip(imgs[:3], padding=0).shape == (16, 48, 3)
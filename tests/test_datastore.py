@@ -0,0 +1,117 @@
+import os
+import multiprocessing as mp
+
+import pytest
+
+from dalle_sessions.datastore import PackFileStore, LooseFileStore, convert_datastore
+
+
+def test_pack_put_get_reopen(tmp_path):
+    store = PackFileStore(str(tmp_path / "pk"))
+    store.put("aaaa", b"AAAA")
+    store.put("bbbb", b"BB")
+    assert store.get("aaaa") == b"AAAA"
+    store.close()
+
+    store = PackFileStore(str(tmp_path / "pk"))
+    assert store.keys() == ["aaaa", "bbbb"]
+    assert store.get("bbbb") == b"BB"
+    store.close()
+
+
+def test_pack_two_handles_do_not_clobber(tmp_path):
+    a = PackFileStore(str(tmp_path / "pk"))
+    b = PackFileStore(str(tmp_path / "pk"))
+    a.put("x", b"AAAA")
+    b.put("y", b"BBBB")
+    assert a.get("y") == b"BBBB"
+    assert b.get("x") == b"AAAA"
+    a.close()
+    b.close()
+
+    c = PackFileStore(str(tmp_path / "pk"))
+    assert c.get("x") == b"AAAA"
+    assert c.get("y") == b"BBBB"
+    c.close()
+
+
+def test_pack_torn_index_line_is_repaired(tmp_path):
+    path = str(tmp_path / "pk")
+    store = PackFileStore(path)
+    store.put("aaaa", b"A")
+    store.close()
+
+    # Simulate a crash halfway through writing an index entry
+    with open(os.path.join(path, "pack-00000.idx"), "a") as idx:
+        idx.write("bbbb 3")
+
+    store = PackFileStore(path)
+    store.put("cccc", b"CCCCC")
+    assert store.has("cccc")
+    store.close()
+
+    store = PackFileStore(path)
+    assert store.keys() == ["aaaa", "cccc"]
+    assert store.get("cccc") == b"CCCCC"
+    store.close()
+
+
+def test_pack_compact_drops_deleted(tmp_path):
+    path = str(tmp_path / "pk")
+    store = PackFileStore(path)
+    store.put("aaaa", b"A" * 100)
+    store.put("bbbb", b"B" * 100)
+    store.delete("aaaa")
+    store.compact(background=False)
+    assert store.keys() == ["bbbb"]
+    assert store.get("bbbb") == b"B" * 100
+    store.close()
+    assert not os.path.exists(os.path.join(path, "pack-00000.dat"))
+
+
+def _hold_open_and_try_compact(path, opened, attempt, result):
+    store = PackFileStore(path)
+    opened.set()
+    attempt.wait(30)
+    result.put(store.compact(background=False) is not None or os.path.exists(os.path.join(path, "pack-00001.dat")))
+    store.close()
+
+
+def test_pack_refused_compaction_keeps_shared_lock(tmp_path):
+    path = str(tmp_path / "pk")
+    a = PackFileStore(path)
+    a.put("aaaa", b"A")
+
+    ctx = mp.get_context("fork")
+    opened, attempt, result = ctx.Event(), ctx.Event(), ctx.Queue()
+    proc = ctx.Process(target=_hold_open_and_try_compact, args=(path, opened, attempt, result))
+    proc.start()
+    assert opened.wait(30)
+
+    # Refused while the other process has the store open ...
+    assert a.compact(background=False) is None
+    # ... and that refusal must not let the other process compact underneath us
+    attempt.set()
+    assert result.get(timeout=30) is False
+    proc.join(30)
+
+    a.put("bbbb", b"B")
+    assert a.get("bbbb") == b"B"
+    a.close()
+
+
+def test_convert_datastore(tmp_path):
+    loose = LooseFileStore(str(tmp_path / "loose"))
+    loose.put("abcd1234", b"hi")
+    loose.close()
+
+    assert convert_datastore(str(tmp_path / "loose"), str(tmp_path / "pk")) == 1
+    store = PackFileStore(str(tmp_path / "pk"))
+    assert store.get("abcd1234") == b"hi"
+    store.close()
+
+
+def test_convert_datastore_missing_source(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        convert_datastore(str(tmp_path / "missing"), str(tmp_path / "pk"))
+    assert not os.path.exists(str(tmp_path / "missing"))
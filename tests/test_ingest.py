@@ -0,0 +1,74 @@
+import io
+import base64
+import shutil
+
+import pytest
+
+np = pytest.importorskip("numpy")
+docarray = pytest.importorskip("docarray")
+pytest.importorskip("matplotlib")
+
+import PIL.Image
+from docarray import Document, DocumentArray
+
+from dalle_sessions.database import QueryDatabase
+from dalle_sessions.ingest import ingest_files
+
+
+def _grid(text, n=4):
+    # dalle-flow returns each tile as a data uri next to the query text
+    docs = []
+    for i in range(n):
+        buf = io.BytesIO()
+        PIL.Image.fromarray(np.full((8, 8, 3), i * 40, dtype=np.uint8)).save(buf, "png")
+        docs.append(Document(text=text, uri="data:image/png;base64," + base64.b64encode(buf.getvalue()).decode()))
+    return DocumentArray(docs)
+
+
+def test_ingest_dump_round_trip(tmp_path):
+    _grid("a photo of a happy puppy").save_binary(str(tmp_path / "dump.bin"))
+
+    qdb = QueryDatabase(str(tmp_path / "queries.db"), str(tmp_path / "store"), backend="pack")
+    qdb.initdb()
+    stats = ingest_files(qdb, [str(tmp_path / "dump.bin")], workers=1)
+    assert stats['added'] == 1
+
+    fhash = qdb.conn.execute("SELECT FILEHASH FROM QUERIES").fetchone()[0]
+    qd = qdb.rebuild_doc(fhash)
+    assert qd.get_text() == "a photo of a happy puppy"
+    assert qd.grid_image(show_index=False).shape == (2 * 8 + 3 * 2, 2 * 8 + 3 * 2, 3)
+    qdb.close()
+
+
+def test_ingest_skips_duplicates(tmp_path):
+    dumps = tmp_path / "dumps"
+    dumps.mkdir()
+    _grid("q").save_binary(str(dumps / "a.bin"))
+    shutil.copy(str(dumps / "a.bin"), str(dumps / "b.bin"))
+
+    qdb = QueryDatabase(str(tmp_path / "queries.db"), str(tmp_path / "store"), backend="pack")
+    qdb.initdb()
+    stats = ingest_files(qdb, [str(dumps)], workers=1)
+    assert stats['files'] == 2
+    assert stats['added'] == 1
+    assert stats['duplicates'] == 1
+    assert qdb.conn.execute("SELECT COUNT(*) FROM QUERIES").fetchone()[0] == 1
+    qdb.close()
+
+
+def test_ingest_base64_matches_save_qd(tmp_path):
+    from dalle_sessions.document import QueryDocument
+
+    grid = Document(text="q", matches=_grid("q")).matches
+    qd = QueryDocument(da=grid)
+    dumps = tmp_path / "dumps"
+    dumps.mkdir()
+    qd.to_base64_file(str(dumps / "grid.b64"))
+
+    qdb = QueryDatabase(str(tmp_path / "queries.db"), str(tmp_path / "store"), backend="pack")
+    qdb.initdb()
+    qdb.save_qd(qd)
+    stats = ingest_files(qdb, [str(dumps)], workers=1)
+    assert stats['duplicates'] == 1
+    assert stats['added'] == 0
+    qdb.close()
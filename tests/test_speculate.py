@@ -0,0 +1,79 @@
+import time
+
+from dalle_sessions.speculate import SpeculativeCache
+
+
+class FakeDoc:
+    def __init__(self, dhash, delay=0.2):
+        self.dhash = dhash
+        self.delay = delay
+        self.started = []
+
+    def get_hash(self):
+        return self.dhash
+
+    def diffuse(self, skip_rate, idx):
+        self.started.append(idx)
+        time.sleep(self.delay)
+        return ("diffuse", self.dhash, skip_rate, idx)
+
+    def upscale(self, idx):
+        return ("upscale", self.dhash, idx)
+
+
+def test_take_returns_speculated_result():
+    cache = SpeculativeCache(max_workers=2, budget=2)
+    doc = FakeDoc("a", delay=0.01)
+    cache.speculate(doc, range(8))
+    assert cache.take(doc, 'diffuse', 1, 0.5) == ("diffuse", "a", 0.5, 1)
+    assert cache.take(doc, 'diffuse', 5, 0.5) is None
+    cache.shutdown()
+
+
+def test_reprioritize_requeues_candidates():
+    cache = SpeculativeCache(max_workers=1, budget=4)
+    doc = FakeDoc("a")
+    cache.speculate(doc, range(8))
+    cache.speculate(doc, [5, 2], reprioritize=True)
+    tiles = sorted(key[2] for key in cache.results)
+    assert 5 in tiles and 2 in tiles
+    assert 3 not in tiles
+    cache.shutdown()
+
+
+def test_take_does_not_wait_on_queued_request():
+    cache = SpeculativeCache(max_workers=1, budget=4)
+    doc = FakeDoc("a", delay=0.5)
+    cache.speculate(doc, range(4))
+    start = time.time()
+    assert cache.take(doc, 'diffuse', 3, 0.5) is None
+    assert time.time() - start < 0.2
+    cache.shutdown()
+
+
+def test_new_grid_discards_old_results():
+    cache = SpeculativeCache(max_workers=1, budget=2)
+    cache.speculate(FakeDoc("a", delay=0.01), [0, 1])
+    cache.speculate(FakeDoc("b", delay=0.01), [0])
+    assert [key[0] for key in cache.results] == ["b"]
+    cache.shutdown()
+
+
+def test_shutdown_makes_cache_inert():
+    cache = SpeculativeCache()
+    doc = FakeDoc("a", delay=0.01)
+    cache.shutdown()
+    cache.speculate(doc, [0, 1])
+    assert cache.take(doc, 'diffuse', 0, 0.5) is None
+    assert doc.started == []
+
+
+def test_clone_is_independent():
+    cache = SpeculativeCache(max_workers=3, budget=5, skip_rate=0.7, ops=('diffuse', 'upscale'))
+    other = cache.clone()
+    assert (other.max_workers, other.budget, other.skip_rate, other.ops) == (3, 5, 0.7, ('diffuse', 'upscale'))
+    cache.shutdown()
+    doc = FakeDoc("a", delay=0.01)
+    other.speculate(doc, [0])
+    assert other.take(doc, 'diffuse', 0, 0.7) == ("diffuse", "a", 0.7, 0)
+    other.shutdown()